@@ -3,12 +3,12 @@ __DOC__ = """
 Create A MEP Network in Revit by selected revit line"""
 
 # System Imports
-import traceback
 import sys
 
 
 # Revit API Imports
 import Autodesk.Revit.DB as DB
+from Autodesk.Revit.Exceptions import InvalidOperationException, ArgumentException
 
 # Pyrevit Imports
 from pyrevit.forms import alert
@@ -17,9 +17,10 @@ from pyrevit.forms import CommandSwitchWindow
 # Custom Imports
 from utils import Commands
 from utils import (get_MEPcurve_elementtypes_by_category,
-                   create_MEPcurve_element,
+                   make_MEPcurve_element_creator,
                    group_MEPcuve_element_connectors_by_location,
                    filter_MEPcurve_elements_using_connectors,
+                   build_MEPcurve_element_info,
                    create_fitting,
                    flexform,
                    )
@@ -53,23 +54,22 @@ if not PICKED_COMMAND:
     alert("Please select a MEP network type to create.")
     sys.exit()
 
-# Get MEP network types and systems based on the selected command
-mep_network_types = None
-mep_network_systems = None
-if PICKED_COMMAND == Commands.CREATE_DUCT_NETWORK:
-    mep_network_types = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_DuctCurves)
-    mep_network_systems = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_DuctSystem)
-
-elif PICKED_COMMAND == Commands.CREATE_PIPE_NETWORK:
-    mep_network_types = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_PipeCurves)
-    mep_network_systems = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_PipingSystem)
-
-elif PICKED_COMMAND == Commands.CREATE_CABLE_TRAY_NETWORK:
-    mep_network_types = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_CableTray)
-    
-
-elif PICKED_COMMAND == Commands.CREATE_CONDUITS_NETWORK:
-    mep_network_types = get_MEPcurve_elementtypes_by_category(DB.BuiltInCategory.OST_Conduit)
+# Get MEP network types and systems based on the selected command; cable trays
+# and conduits have no system category
+CATEGORY_MAP = {
+    Commands.CREATE_DUCT_NETWORK:       (DB.BuiltInCategory.OST_DuctCurves, DB.BuiltInCategory.OST_DuctSystem),
+    Commands.CREATE_PIPE_NETWORK:       (DB.BuiltInCategory.OST_PipeCurves, DB.BuiltInCategory.OST_PipingSystem),
+    Commands.CREATE_CABLE_TRAY_NETWORK: (DB.BuiltInCategory.OST_CableTray, None),
+    Commands.CREATE_CONDUITS_NETWORK:   (DB.BuiltInCategory.OST_Conduit, None),
+}
+type_category, system_category = CATEGORY_MAP[PICKED_COMMAND]
+mep_network_types = get_MEPcurve_elementtypes_by_category(type_category)
+mep_network_systems = get_MEPcurve_elementtypes_by_category(system_category) if system_category else None
+
+# Bail out before the form round-trip when the document has no usable types
+if not mep_network_types:
+    alert("No element types found in this document for {}.".format(PICKED_COMMAND))
+    sys.exit()
 
 # Show a flexform to get the MEP network type, system and level
 # If the user cancels the operation, exit the script
@@ -89,43 +89,63 @@ mep_network_type_id, mep_network_system_id, level_id = flexform_data
 mep_elements = [] # List to store created MEP elements
 mep_elements_connectors = [] # List to store all connectors from created MEP elements
 
-# Start a transaction group to create the PICKED_COMMAND
-tg = DB.TransactionGroup(DOC, "{}".format(PICKED_COMMAND))
-tg.Start()
-
-t = DB.Transaction(DOC, "{}".format(PICKED_COMMAND)) # Transaction to create MEP network
+# One transaction covers both element creation and fittings, so the document
+# regenerates once at the end instead of after each stage
+t = DB.Transaction(DOC, "{}".format(PICKED_COMMAND))
+failure_options = t.GetFailureHandlingOptions()
+failure_options.SetClearAfterRollback(True)
+t.SetFailureHandlingOptions(failure_options)
 t.Start()
 
+# Resolve the Create call once so the loop does no per-line dispatch
+create_element = make_MEPcurve_element_creator(DOC, PICKED_COMMAND,
+                                               mep_network_type_id,
+                                               level_id,
+                                               system_type_id=mep_network_system_id)
+add_connector = mep_elements_connectors.append # Hoist the bound method out of the loop
+idx = 0
 for mline in selected_model_lines:
     curve = mline.GeometryCurve
     start = curve.GetEndPoint(0)
     end = curve.GetEndPoint(1)
-    duct = create_MEPcurve_element(DOC, PICKED_COMMAND,
-                                mep_network_type_id,
-                                level_id,
-                                start,
-                                end,
-                                system_type_id=mep_network_system_id)
+    # Skip zero-length lines up front; Duct/Pipe.Create would throw and
+    # abort the whole transaction partway through.
+    d = start - end
+    if d.X * d.X + d.Y * d.Y + d.Z * d.Z < 1e-8:
+        continue
+    duct = create_element(start, end)
     mep_elements.append(duct)
-    mep_elements_connectors.extend([c for c in duct.ConnectorManager.Connectors])
-t.Commit()
+    # Tag each connector with its owner's list index so the fittings pass can
+    # resolve owners by plain indexing; walk the ConnectorSet only once.
+    for c in duct.ConnectorManager.Connectors:
+        add_connector((idx, c))
+    idx += 1
+
+# Regenerate once so connector origins reflect the new elements before grouping
+DOC.Regenerate()
+
+mep_element_info = build_MEPcurve_element_info(mep_elements) # Cache curves and directions once
 
 connector_groups = group_MEPcuve_element_connectors_by_location(mep_elements_connectors)
 
-t = DB.Transaction(DOC, "{} Fittings".format(PICKED_COMMAND)) # Transaction to create fittings
-t.Start()
+sub = DB.SubTransaction(DOC) # Each fitting gets its own subtransaction so one failure
+                             # rolls back only that fitting, not the whole batch
 for group in connector_groups.values():
+    # Most groups are free ends with a single connector; skip them before
+    # paying for the element filter and the try/except machinery.
+    if len(group) < 2 or len(group) > 4:
+        continue
+    sub.Start()
     try:
         connected_ducts = filter_MEPcurve_elements_using_connectors(group, mep_elements)
-        create_fitting(DOC, connected_ducts)
-    except:
-        print("Error\n")
-        print(traceback.format_exc())
-        print("\n")
-        
-t.Commit()
+        create_fitting(DOC, connected_ducts, mep_element_info)
+        sub.Commit()
+    except (InvalidOperationException, ArgumentException):
+        # The Revit API rejected this particular fitting (e.g. incompatible
+        # connectors); roll back just this group and keep the batch going.
+        sub.RollBack()
 
-tg.Assimilate()
+t.Commit()
 
     
 
@@ -3,6 +3,13 @@ import sys
 import math
 from collections import defaultdict
 
+# NumPy is only available under pyRevit's CPython engine; fall back to
+# the scalar helpers when it is missing (IronPython).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Revit API Imports
 import Autodesk.Revit.DB as DB
 import Autodesk.Revit.UI as UI
@@ -22,63 +29,131 @@ class Commands:
     CREATE_PIPE_NETWORK = "Create Pipe Network"
     CREATE_CABLE_TRAY_NETWORK = "Create Cable Tray Network"
     CREATE_CONDUITS_NETWORK = "Create Conduits Network"
-    
-def group_MEPcuve_element_connectors_by_location(MEPcuve_element_connectors):
+
+# Module-level bindings of the command constants; cheaper to look up than a
+# class attribute on every comparison in IronPython
+_CMD_DUCT = Commands.CREATE_DUCT_NETWORK
+_CMD_PIPE = Commands.CREATE_PIPE_NETWORK
+_CMD_TRAY = Commands.CREATE_CABLE_TRAY_NETWORK
+_CMD_COND = Commands.CREATE_CONDUITS_NETWORK
+
+
+def spatial_hash(tagged_connectors, cell=0.01):
     """
-    Groups MEP curve element connectors by their spatial location.
+    Buckets tagged connectors into a uniform voxel grid keyed by integer cell coordinates.
 
     Args:
-        MEPcuve_element_connectors (List[DB.Connector]): A list of MEP curve element connectors.
+        tagged_connectors (List[tuple]): A list of (owner index, DB.Connector) pairs,
+            where the owner index is the connector owner's position in the element list.
+        cell (float, optional): The voxel edge length in model units. Defaults to 0.01.
 
     Returns:
-        defaultdict: A dictionary where the keys are tuples representing
-        the rounded (to 3 decimal places) X, Y, Z coordinatesof each connector's origin,
-        and the values are lists of connectors at those locations.
+        defaultdict: A dictionary mapping (i, j, k) cell coordinates to the
+        (owner index, connector) pairs whose origins fall inside that cell.
+    """
+    hashed = defaultdict(list)
+    inv_cell = 1.0 / cell
+    for pair in tagged_connectors:
+        p = pair[1].Origin # Read the interop property once per connector
+        key = (int(math.floor(p.X * inv_cell)),
+               int(math.floor(p.Y * inv_cell)),
+               int(math.floor(p.Z * inv_cell)))
+        hashed[key].append(pair)
+    return hashed
+
+def group_MEPcuve_element_connectors_by_location(MEPcuve_element_connectors, tolerance=0.01):
+    """
+    Groups tagged MEP curve element connectors by their spatial location.
+
+    Connectors are first bucketed into a spatial hash with a cell size equal to the
+    tolerance, then each occupied cell is merged with its 26 neighbouring cells. This
+    keeps connectors in the same group even when numeric drift pushes coincident
+    origins across a cell boundary, which exact coordinate rounding would miss.
+    Each connector carries its owner's integer index in the element list, so group
+    consumers can resolve owners with plain list indexing instead of ElementId hashing.
 
+    Args:
+        MEPcuve_element_connectors (List[tuple]): A list of (owner index, DB.Connector) pairs.
+        tolerance (float, optional): The distance within which connectors are
+            considered coincident. Defaults to 0.01.
+
+    Returns:
+        dict: A dictionary where the keys are the (i, j, k) cell coordinates of each
+        cluster's seed cell, and the values are lists of (owner index, connector)
+        pairs at that location.
     """
-    grouped = defaultdict(list)
-    for c in MEPcuve_element_connectors:
-        p = c.Origin
-        key = (round(p.X, 3), round(p.Y, 3), round(p.Z, 3))
-        grouped[key].append(c)
+    hashed = spatial_hash(MEPcuve_element_connectors, cell=tolerance)
+    grouped = {}
+    visited = set()
+    for key in hashed:
+        if key in visited:
+            continue
+        x, y, z = key
+        cluster = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    nkey = (x + dx, y + dy, z + dz)
+                    if nkey in hashed and nkey not in visited:
+                        visited.add(nkey)
+                        cluster.extend(hashed[nkey])
+        grouped[key] = cluster
     return grouped
 
-def filter_MEPcurve_elements_using_connectors(connectors, all_MEPcurve_elements):
+def filter_MEPcurve_elements_using_connectors(tagged_connectors, MEPcurve_elements):
     """
-    Filters a list of MEP curve elements to include only those that are associated with the given connectors.
+    Resolves the MEP curve elements that own the given tagged connectors.
+
+    The owner index tagged onto each connector when it was collected is used for
+    plain list indexing, so no ElementId hashing or Owner interop calls are needed.
 
     Args:
-        MEPcuve_element_connectors (List[DB.Connector]): A list of MEP curve element connectors.
-        all_MEPcurve_elements (List): An iterable of MEP curve elements (e.g., ducts, pipes, cable trays, conduits).
+        tagged_connectors (List[tuple]): A list of (owner index, DB.Connector) pairs.
+        MEPcurve_elements (list): The element list the owner indices point into
+        (e.g., ducts, pipes, cable trays, conduits).
 
     Returns:
-        list: A list of MEP curve elements whose Id matches the Owner.Id of any connector in the connectors list.
+        list: The distinct MEP curve elements owning the connectors, in element-list order.
     """
-    connector_owner_ids = set(c.Owner.Id for c in connectors)
-    return [duct for duct in all_MEPcurve_elements if duct.Id in connector_owner_ids]
+    owner_indices = set(pair[0] for pair in tagged_connectors)
+    return [MEPcurve_elements[i] for i in sorted(owner_indices)]
 
-def find_shared_point_between_curves(c1, c2):
+def find_shared_point_between_endpoints(points1, points2, tolerance=0.01):
     """
-    Finds a shared (coincident) endpoint between two curve objects.
+    Finds a shared (coincident) endpoint between two cached endpoint pairs.
 
-    Given two curve objects c1 and c2, this function checks if any of their endpoints are
-    within a small distance threshold (0.1 units) of each other, indicating they share a point.
-    If such a point is found, it returns the midpoint between the two coincident endpoints.
-    If no shared point is found, returns None.
+    Given the (start, end) endpoint pairs of two curves, this function checks if any of
+    the endpoints are within the tolerance of each other, indicating the curves share a
+    point. An envelope test runs first: when the endpoint bounding boxes are separated
+    by more than the tolerance on any axis, the pairwise comparison is skipped entirely.
+    The comparison uses squared distances so no square root is taken, and the search
+    returns as soon as the first coincident pair is found.
+    The endpoints are expected to come from build_MEPcurve_element_info, so no
+    GetEndPoint interop calls happen here.
 
     Args:
-        c1: The first curve object, expected to have a GetEndPoint(index) method.
-        c2: The second curve object, expected to have a GetEndPoint(index) method.
+        points1 (tuple): The (start, end) endpoints of the first curve.
+        points2 (tuple): The (start, end) endpoints of the second curve.
+        tolerance (float, optional): The coincidence distance threshold. Defaults to 0.01.
 
     Returns:
         The midpoint (as a point object) between the shared endpoints if found, otherwise None.
     """
-    if not c1 or not c2: return None
-    points1 = [c1.GetEndPoint(0), c1.GetEndPoint(1)]
-    points2 = [c2.GetEndPoint(0), c2.GetEndPoint(1)]
+    if not points1 or not points2: return None
+    p10, p11 = points1
+    p20, p21 = points2
+    if (min(p10.X, p11.X) - max(p20.X, p21.X) > tolerance or
+            min(p20.X, p21.X) - max(p10.X, p11.X) > tolerance or
+            min(p10.Y, p11.Y) - max(p20.Y, p21.Y) > tolerance or
+            min(p20.Y, p21.Y) - max(p10.Y, p11.Y) > tolerance or
+            min(p10.Z, p11.Z) - max(p20.Z, p21.Z) > tolerance or
+            min(p20.Z, p21.Z) - max(p10.Z, p11.Z) > tolerance):
+        return None
+    tol2 = tolerance * tolerance
     for p1 in points1:
         for p2 in points2:
-            if p1.DistanceTo(p2) < 0.01:
+            d = p1 - p2
+            if d.X * d.X + d.Y * d.Y + d.Z * d.Z < tol2:
                 return (p1 + p2) * 0.5
     return None
 
@@ -99,8 +174,9 @@ def get_MEPcurve_element_direction(MEPcurve_element):
 
 def are_directions_parallel(v1, v2, tolerance=0.01):
     """ Checks if two direction vectors are parallel within a specified tolerance.
-    This function calculates the sine of the angle between two vectors using the AngleTo method.
-    If the sine of the angle is less than the specified tolerance, the vectors are considered parallel.
+    For unit vectors the magnitude of their cross product equals the sine of the angle
+    between them, so comparing the squared cross-product length against the squared
+    tolerance gives the same result as sin(AngleTo) without any transcendental calls.
     This is useful for determining if two MEP curve elements are aligned in the same or opposite directions.
 
     Args:
@@ -111,13 +187,36 @@ def are_directions_parallel(v1, v2, tolerance=0.01):
     Returns:
         bool: True if the vectors are parallel within the specified tolerance, False otherwise.
     """
-    return math.sin(v1.AngleTo(v2)) < tolerance
+    return v1.CrossProduct(v2).GetLengthSquared() < tolerance * tolerance
+
+def parallel_flags(reference_direction, other_directions, tolerance=0.01):
+    """ Checks which of several direction vectors are parallel to a reference direction.
+    When NumPy is available the cross products against the reference are computed in a
+    single vectorized call instead of one Python-level are_directions_parallel call per
+    vector; otherwise it falls back to the scalar helper. Used by create_fitting to
+    drive the tee and cross branch selection from one batch of comparisons.
+
+    Args:
+        reference_direction (DB.XYZ): The direction the others are compared against.
+        other_directions (sequence of DB.XYZ): The directions to test.
+        tolerance (float, optional): The tolerance level for determining parallelism. Defaults to 0.01.
+
+    Returns:
+        list: A list of bools, one per entry of other_directions.
+    """
+    if np is not None and len(other_directions) > 1:
+        ref = np.array((reference_direction.X, reference_direction.Y, reference_direction.Z))
+        others = np.array([(d.X, d.Y, d.Z) for d in other_directions])
+        cross = np.cross(others, ref)
+        return list((cross * cross).sum(axis=1) < tolerance * tolerance)
+    return [are_directions_parallel(reference_direction, d, tolerance)
+            for d in other_directions]
 
 def MEPcurve_element_nearest_connector_to_point(MEPcurve_element, point):
     """ Finds the nearest connector to a given point on a MEP curve element.
-    This function retrieves all connectors from the MEP curve element's ConnectorManager,
-    sorts them based on their distance to the specified point, and returns the closest connector.
-    If the MEP curve element has no connectors, it returns None.
+    This function retrieves all connectors from the MEP curve element's ConnectorManager
+    and returns the one closest to the specified point in a single min() pass, comparing
+    squared distances so no square roots are taken and no sorted copy is allocated.
     If there are multiple connectors at the same distance, it returns the first one found.
 
     Args:
@@ -125,12 +224,36 @@ def MEPcurve_element_nearest_connector_to_point(MEPcurve_element, point):
         point (DB.XYZ): The point to which the nearest connector is to be found.
 
     Returns:
-        DB.Connector: The nearest connector to the specified point, or None if no connectors are found.
+        DB.Connector: The nearest connector to the specified point.
+    """
+    def distance_squared(c):
+        v = c.Origin - point
+        return v.X * v.X + v.Y * v.Y + v.Z * v.Z
+    return min(MEPcurve_element.ConnectorManager.Connectors, key=distance_squared)
+
+def build_MEPcurve_element_info(MEPcurve_elements):
+    """ Caches the direction and endpoints of each MEP curve element.
+    Location.Curve and GetEndPoint are Revit interop calls and the direction requires
+    a Normalize call, so all of them are resolved once per element here instead of
+    once per fitting in create_fitting.
+
+    Args:
+        MEPcurve_elements (List[DB.MEPcurve_element]): The MEP curve elements to index.
+
+    Returns:
+        dict: A dictionary mapping each element's Id to a (direction, (start, end)) tuple.
     """
-    connectors = MEPcurve_element.ConnectorManager.Connectors
-    return sorted(connectors, key=lambda c: c.Origin.DistanceTo(point))[0]
+    info = {}
+    for element in MEPcurve_elements:
+        curve = element.Location.Curve if isinstance(element.Location, LocationCurve) else None
+        if curve:
+            start, end = curve.GetEndPoint(0), curve.GetEndPoint(1)
+            info[element.Id] = ((end - start).Normalize(), (start, end))
+        else:
+            info[element.Id] = (None, None)
+    return info
 
-def create_fitting(doc, ducts):
+def create_fitting(doc, ducts, MEPcurve_element_info):
     """ Creates a fitting for MEP curve elements based on their connectors and directions.
     This function checks the number of ducts provided and creates a fitting based on their connectors.
     It supports creating union, elbow, tee, and cross fittings depending on the number of ducts and their directions.
@@ -138,40 +261,46 @@ def create_fitting(doc, ducts):
     then retrieves the nearest connectors to that point for each duct.
     It checks the directions of the ducts to determine if they are parallel or not,
     and creates the appropriate fitting type accordingly.
+    Directions and endpoints are looked up in MEPcurve_element_info (see
+    build_MEPcurve_element_info) rather than re-queried from the Revit API per call.
 
     Args:
         doc (DB.Document): The Revit document where the fitting will be created.
         ducts (List[DB.MEPcurve_element]): A list of MEP curve elements (ducts) to create a fitting for.
+        MEPcurve_element_info (dict): A dictionary mapping element Id to (direction, (start, end)).
     """
     count = len(ducts)
     if count < 2 or count > 4:
         return
 
-    c1 = (ducts[0].Location).Curve if isinstance(ducts[0].Location, LocationCurve) else None
-    c2 = (ducts[1].Location).Curve if isinstance(ducts[1].Location, LocationCurve) else None
-    intersection = find_shared_point_between_curves(c1, c2)
-    if not intersection: return
+    # Bind the hot helpers to locals; global lookups are comparatively
+    # expensive in IronPython and these run several times per fitting.
+    nearest_connector = MEPcurve_element_nearest_connector_to_point
+    parallel = are_directions_parallel
 
-    conn1 = MEPcurve_element_nearest_connector_to_point(ducts[0], intersection)
-    conn2 = MEPcurve_element_nearest_connector_to_point(ducts[1], intersection)
+    dir1, pts1 = MEPcurve_element_info[ducts[0].Id]
+    dir2, pts2 = MEPcurve_element_info[ducts[1].Id]
+    intersection = find_shared_point_between_endpoints(pts1, pts2)
+    if not intersection: return
 
-    dir1 = get_MEPcurve_element_direction(ducts[0])
-    dir2 = get_MEPcurve_element_direction(ducts[1])
+    conn1 = nearest_connector(ducts[0], intersection)
+    conn2 = nearest_connector(ducts[1], intersection)
 
     if count == 2:
-        if are_directions_parallel(dir1, dir2):
+        if parallel(dir1, dir2):
             doc.Create.NewUnionFitting(conn1, conn2)
         else:
             doc.Create.NewElbowFitting(conn1, conn2)
 
     elif count == 3:
         duct3 = ducts[2]
-        conn3 = MEPcurve_element_nearest_connector_to_point(duct3, intersection)
-        dir3 = get_MEPcurve_element_direction(duct3)
+        conn3 = nearest_connector(duct3, intersection)
+        dir3 = MEPcurve_element_info[duct3.Id][0]
 
-        if are_directions_parallel(dir1, dir2):
+        flag12, flag13 = parallel_flags(dir1, (dir2, dir3))
+        if flag12:
             doc.Create.NewTeeFitting(conn1, conn2, conn3)
-        elif are_directions_parallel(dir1, dir3):
+        elif flag13:
             doc.Create.NewTeeFitting(conn3, conn1, conn2)
         else:
             doc.Create.NewTeeFitting(conn3, conn2, conn1)
@@ -179,59 +308,79 @@ def create_fitting(doc, ducts):
     elif count == 4:
         duct3 = ducts[2]
         duct4 = ducts[3]
-        conn3 = MEPcurve_element_nearest_connector_to_point(duct3, intersection)
-        conn4 = MEPcurve_element_nearest_connector_to_point(duct4, intersection)
+        conn3 = nearest_connector(duct3, intersection)
+        conn4 = nearest_connector(duct4, intersection)
 
-        dir3 = get_MEPcurve_element_direction(duct3)
-        dir4 = get_MEPcurve_element_direction(duct4)
+        dir3 = MEPcurve_element_info[duct3.Id][0]
+        dir4 = MEPcurve_element_info[duct4.Id][0]
 
-        if are_directions_parallel(dir1, dir2):
+        flag12, flag13, flag14 = parallel_flags(dir1, (dir2, dir3, dir4))
+        if flag12:
             doc.Create.NewCrossFitting(conn1, conn2, conn3, conn4)
-        elif are_directions_parallel(dir1, dir3):
+        elif flag13:
             doc.Create.NewCrossFitting(conn1, conn3, conn2, conn4)
-        elif are_directions_parallel(dir1, dir4):
+        elif flag14:
             doc.Create.NewCrossFitting(conn1, conn4, conn2, conn3)
        
+# Session caches for collector-backed lookups; FilteredElementCollector scans the
+# whole document, so repeat queries within one run are answered from here.
+_elementtypes_cache = {}
+_levels_cache = {}
+
 def get_MEPcurve_elementtypes_by_category(builtin_category):
     """
     Retrieves MEP curve element types by built-in category.
 
+    Results are memoized per document and category, so repeat calls within a session
+    (e.g. types and systems for the same network) skip the document scan.
+    The collector is enumerated once, reading the name parameter in the same pass;
+    types without a name parameter are skipped instead of crashing the lookup.
+
     Args:
         category (BuiltInCategory): The category of MEP curve elements to filter by.
 
     Returns:
         dict: A dictionary mapping element names to their corresponding element types.
     """
-    element_types = DB.FilteredElementCollector(doc).\
-                    OfCategory(builtin_category).\
-                    WhereElementIsElementType()
-    names = [x.get_Parameter(DB.BuiltInParameter.SYMBOL_NAME_PARAM).AsString() for x in element_types]
-    return dict(zip(names, element_types))
-
-def create_MEPcurve_element(doc,command, type_id, level_id, start, end, system_type_id=None):
+    key = (doc.GetHashCode(), int(builtin_category))
+    cached = _elementtypes_cache.get(key)
+    if cached is not None:
+        return cached
+    result = {}
+    for element_type in DB.FilteredElementCollector(doc).\
+                        OfCategory(builtin_category).\
+                        WhereElementIsElementType():
+        name_param = element_type.get_Parameter(DB.BuiltInParameter.SYMBOL_NAME_PARAM)
+        if name_param is not None:
+            result[name_param.AsString()] = element_type
+    _elementtypes_cache[key] = result
+    return result
+
+def make_MEPcurve_element_creator(doc, command, type_id, level_id, system_type_id=None):
     """
-    Creates a MEP curve element (Duct, Pipe, Cable Tray, or Conduit) in the Revit document.
+    Resolves the creation method for a MEP curve element (Duct, Pipe, Cable Tray, or Conduit) once.
+
+    The command dispatch and the fixed arguments (type, level, system type) are bound up front
+    so the creation loop only pays for the Revit Create call itself, not a per-line dispatch.
 
     Args:
         doc (Document): The Revit document.
         command (str): The type of MEP curve element to create.
         type_id (ElementId): The ID of the MEP curve element type.
-        level_id (ElementId): The ID of the level where the element will be created.
-        start (XYZ): The start point of the MEP curve element.
-        end (XYZ): The end point of the MEP curve element.
+        level_id (ElementId): The ID of the level where the elements will be created.
         system_type_id (ElementId, optional): The ID of the system type for Ducts or Pipes.
 
     Returns:
-        Element: The created MEP curve element.
+        callable: A function taking (start, end) that creates and returns the MEP curve element.
     """
-    if command == Commands.CREATE_DUCT_NETWORK:
-        return Duct.Create(doc, system_type_id, type_id, level_id, start, end)
-    elif command == Commands.CREATE_PIPE_NETWORK:
-        return Pipe.Create(doc, system_type_id, type_id, level_id, start, end)
-    elif command == Commands.CREATE_CABLE_TRAY_NETWORK:
-        return CableTray.Create(doc, type_id, start, end, level_id)
-    elif command == Commands.CREATE_CONDUITS_NETWORK:
-        return Conduit.Create(doc, type_id, start, end, level_id)
+    if command == _CMD_DUCT:
+        return lambda start, end: Duct.Create(doc, system_type_id, type_id, level_id, start, end)
+    elif command == _CMD_PIPE:
+        return lambda start, end: Pipe.Create(doc, system_type_id, type_id, level_id, start, end)
+    elif command == _CMD_TRAY:
+        return lambda start, end: CableTray.Create(doc, type_id, start, end, level_id)
+    elif command == _CMD_COND:
+        return lambda start, end: Conduit.Create(doc, type_id, start, end, level_id)
     else:
         raise ValueError("Invalid command for creating MEP curve element.")
 
@@ -241,14 +390,20 @@ def get_levels_data():
     and creates a dictionary mapping level names to their corresponding level elements.
     It uses the FilteredElementCollector to gather elements of the BuiltInCategory OST_Levels,
     ensuring that only non-element type levels are included.
+    Results are memoized per document so repeat form invocations skip the document scan.
     It is useful for populating a dropdown list in a user interface for selecting levels.
     """
+    key = doc.GetHashCode()
+    cached = _levels_cache.get(key)
+    if cached is not None:
+        return cached
     levels = DB.FilteredElementCollector(doc).\
                 OfCategory(DB.BuiltInCategory.OST_Levels).\
                 WhereElementIsNotElementType().\
                 ToElements()
     level_names = [level.Name for level in levels]
     levelsdata = dict(zip(level_names, levels))
+    _levels_cache[key] = levelsdata
     return levelsdata
 
 def flexform(commad, mep_network_types, mep_network_systems):